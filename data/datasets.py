@@ -118,7 +118,9 @@ class Fashion_MNIST():
 
 class Sentiment():
 
-    def __init__(self, data_rpath='data/'):
+    def __init__(self, data_rpath='data/', one_hot=True):
+        # one_hot=False yields word ids of shape (N, T) for an Embedding layer instead of (N, T, V) one-hot vectors
+        self.one_hot = one_hot
         # download nltk tokenizer
         nltk.download('punkt')
         # load data
@@ -186,18 +188,18 @@ class Sentiment():
                     pointer = 0
                     idx = np.arange(pointer, pointer+batch)
                     pointer = pointer + batch
-            yield self._one_hot_encoding(self.x_train[idx]), self.y_train[idx]
+            yield self._encoding(self.x_train[idx]), self.y_train[idx]
 
     def test_loader(self, batch):
         pointer = 0
         while pointer+batch <= self.num_test:
             idx = np.arange(pointer, pointer+batch)
             pointer = pointer + batch
-            yield self._one_hot_encoding(self.x_test[idx]), self.y_test[idx]
+            yield self._encoding(self.x_test[idx]), self.y_test[idx]
         if pointer < self.num_test-1:
             idx = np.arange(pointer, self.num_test-pointer-1)
             pointer = self.num_test-1
-            yield self._one_hot_encoding(self.x_test[idx]), self.y_test[idx]
+            yield self._encoding(self.x_test[idx]), self.y_test[idx]
         else:
             return None
 
@@ -206,14 +208,26 @@ class Sentiment():
         while pointer+batch <= self.num_val:
             idx = np.arange(pointer, pointer+batch)
             pointer = pointer + batch
-            yield self._one_hot_encoding(self.x_val[idx]), self.y_val[idx]
+            yield self._encoding(self.x_val[idx]), self.y_val[idx]
         if pointer < self.num_val-1:
             idx = np.arange(pointer, self.num_val-pointer-1)
             pointer = self.num_val-1
-            yield self._one_hot_encoding(self.x_val[idx]), self.y_val[idx]
+            yield self._encoding(self.x_val[idx]), self.y_val[idx]
         else:
             return None
 
+    def _encoding(self, sentences):
+        if self.one_hot:
+            return self._one_hot_encoding(sentences)
+        return self._index_encoding(sentences)
+
+    def _index_encoding(self, sentences, max_length=30):
+        wordids = np.zeros((len(sentences), max_length), dtype=np.int64) # of shape (N, T), 0 for padding
+        for n, s in enumerate(sentences):
+            words = nltk.word_tokenize(s.lower())[:max_length]
+            wordids[n, :len(words)] = [self.dictionary[w] for w in words]
+        return wordids
+
     def _one_hot_encoding(self, sentences, max_length=30):
         vocab_size = len(self.dictionary)
         wordvecs = [] # of shape (N, T, V)
@@ -1,6 +1,8 @@
 from nn.layers import *
 from nn.model import Model
 
+import numpy as np
+
 
 def Fashion_MNISTNet():
     conv1_params = {
@@ -35,19 +37,19 @@ def Fashion_MNISTNet():
     }
     model = Model()
     model.add(Conv2D(conv1_params, name='conv1',
-                          initializer=Gaussian(std=0.001)))
+                          initializer=Gaussian(std=0.001, dtype=np.float32)))
     model.add(ReLU(name='relu1'))
     model.add(Pool2D(pool1_params, name='pooling1'))
     model.add(Conv2D(conv2_params, name='conv2',
-                          initializer=Gaussian(std=0.001)))
+                          initializer=Gaussian(std=0.001, dtype=np.float32)))
     model.add(ReLU(name='relu2'))
     model.add(Pool2D(pool2_params, name='pooling2'))
     # model.add(Dropout(ratio=0.25, name='dropout1'))
     model.add(Flatten(name='flatten'))
     model.add(Linear(400, 256, name='fclayer1',
-                      initializer=Gaussian(std=0.01)))
+                      initializer=Gaussian(std=0.01, dtype=np.float32)))
     model.add(ReLU(name='relu3'))
     # model.add(Dropout(ratio=0.5))
     model.add(Linear(256, 10, name='fclayer2',
-                      initializer=Gaussian(std=0.01)))
+                      initializer=Gaussian(std=0.01, dtype=np.float32)))
     return model
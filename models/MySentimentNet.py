@@ -8,6 +8,7 @@ def MySentimentNet(word_to_idx):
     # Arguments:
         word_to_idx: A dictionary giving the vocabulary. It contains V entries,
             and maps each string to a unique integer in the range [0, V).
+        The model takes word ids, build the dataset with datasets.Sentiment(one_hot=False).
     # Returns
         model: the constructed model
     """
@@ -17,7 +18,7 @@ def MySentimentNet(word_to_idx):
     units = 70
     
     model = Model()
-    model.add(Linear2D(vocab_size, embedding, name='embedding', initializer=Gaussian(std=0.01)))
+    model.add(Embedding(vocab_size, embedding, name='embedding', initializer=Gaussian(std=0.01)))
     model.add(BiRNN(in_features=embedding, units=units, initializer=Gaussian(std=0.01)))
     model.add(Linear2D(2*units, 50, name='linear1', initializer=Gaussian(std=0.01)))
     model.add(TemporalPooling()) # defined in layers.py
@@ -41,26 +41,26 @@ def My_Fashion_MNISTNet():
      
     model = Model() # input 28 x 28
     
-    model.add(Conv2D(conv1_params, name='conv1', initializer=Gaussian(std=0.001))) # 28
+    model.add(Conv2D(conv1_params, name='conv1', initializer=Gaussian(std=0.001, dtype=np.float32))) # 28
     model.add(ReLU(name='relu1'))
-    model.add(Conv2D(conv1_params, name='conv2', initializer=Gaussian(std=0.001))) # 28
+    model.add(Conv2D(conv1_params, name='conv2', initializer=Gaussian(std=0.001, dtype=np.float32))) # 28
     model.add(ReLU(name='relu2'))
     model.add(Pool2D(pool1_params, name='pooling1')) # 27
     model.add(Dropout(rate=0.25, name='dropout1'))
     
-    model.add(Conv2D(conv2_params, name='conv3', initializer=Gaussian(std=0.001))) # 27
+    model.add(Conv2D(conv2_params, name='conv3', initializer=Gaussian(std=0.001, dtype=np.float32))) # 27
     model.add(ReLU(name='relu3'))
-    model.add(Conv2D(conv2_params, name='conv4', initializer=Gaussian(std=0.001))) # 27
+    model.add(Conv2D(conv2_params, name='conv4', initializer=Gaussian(std=0.001, dtype=np.float32))) # 27
     model.add(ReLU(name='relu4'))
     model.add(Pool2D(pool2_params, name='pooling2')) # 25
     model.add(Dropout(rate=0.25, name='dropout2'))
     
     model.add(Flatten(name='flatten'))
     
-    model.add(Linear(64*25*25, 512, name='fclayer1', initializer=Gaussian(std=0.01))) # 512
+    model.add(Linear(64*25*25, 512, name='fclayer1', initializer=Gaussian(std=0.01, dtype=np.float32))) # 512
     model.add(ReLU(name='relu5'))
     model.add(Dropout(rate=0.37, name='dropout3'))
     
-    model.add(Linear(512, 10, name='fclayer2', initializer=Gaussian(std=0.01))) # 10
+    model.add(Linear(512, 10, name='fclayer2', initializer=Gaussian(std=0.01, dtype=np.float32))) # 10
     
     return model
@@ -4,3 +4,4 @@ from . import model
 from . import operators
 from . import optimizers
 from . import initializers
+from . import kernels
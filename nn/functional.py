@@ -1,5 +1,5 @@
 import numpy as np
-from itertools import product
+from numpy.lib.stride_tricks import as_strided
 
 def clip_gradients(in_grads, clip=1):
     return np.clip(in_grads, -clip, clip)
@@ -7,9 +7,25 @@ def clip_gradients(in_grads, clip=1):
 def sigmoid(X):
     return 1.0 / (1 + np.exp(-X))
 
-def img2col(data, h_indices, w_indices, k_h, k_w):
-    batch = data.shape[0]
-    indices = list(product(h_indices, w_indices))
-    out = np.stack(map(
-        lambda x: data[:, :, x[0]:x[0]+k_h, x[1]:x[1]+k_w].reshape(batch, -1), indices), axis=-1)
+def img2col(data, k_h, k_w, stride, out=None):
+    """
+    # Arguments
+        data: padded input array with shape (batch, channel, height, width)
+        k_h: kernel height
+        k_w: kernel width
+        stride: stride length
+        out: optional array with shape (batch, channel, k_h, k_w, out_height, out_width) to copy the receptive fields into
+
+    # Returns
+        out: out if given, else a read-only strided view of all receptive fields, with shape (batch, channel, k_h, k_w, out_height, out_width)
+    """
+    batch, channel, height, width = data.shape
+    out_h = (height - k_h) // stride + 1
+    out_w = (width - k_w) // stride + 1
+    s = data.strides
+    fields = as_strided(data, shape=(batch, channel, k_h, k_w, out_h, out_w),
+                        strides=(s[0], s[1], s[2], s[3], stride * s[2], stride * s[3]), writeable=False)
+    if out is None:
+        return fields
+    out[...] = fields
     return out
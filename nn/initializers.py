@@ -14,38 +14,42 @@ class Initializer():
 
 class Gaussian(Initializer):
 
-	def __init__(self, mean=0, std=0.1):
+	def __init__(self, mean=0, std=0.1, dtype=np.float64):
 		self.mean = mean
 		self.std = std
+		self.dtype = dtype
 
 	def initialize(self, size):
-		return np.random.normal(self.mean, self.std, size=size)
+		return np.random.normal(self.mean, self.std, size=size).astype(self.dtype, copy=False)
 
 
 class Uniform(Initializer):
 
-	def __init__(self, a=-0.05, b=0.05):
+	def __init__(self, a=-0.05, b=0.05, dtype=np.float64):
 		self.a = a
 		self.b = b
+		self.dtype = dtype
 
 	def initialize(self, size):
-		return np.random.uniform(self.a, self.b, size=size)
+		return np.random.uniform(self.a, self.b, size=size).astype(self.dtype, copy=False)
 
 
 class Xavier(Initializer):
 
-	def __init__(self, fan_in, fan_out):
+	def __init__(self, fan_in, fan_out, dtype=np.float64):
 		self.fan_in = fan_in
 		self.fan_out = fan_out
+		self.dtype = dtype
 
 	def initialize(self, size):
-		return np.random.normal(0, math.sqrt(2 / (self.fan_in + self.fan_out)), size=size)
+		return np.random.normal(0, math.sqrt(2 / (self.fan_in + self.fan_out)), size=size).astype(self.dtype, copy=False)
 
 
 class MSRA(Initializer):
 
-	def __init__(self, fan_in):
+	def __init__(self, fan_in, dtype=np.float64):
 		self.fan_in = fan_in
+		self.dtype = dtype
 
 	def initialize(self, size):
-		return np.random.normal(0, math.sqrt(2 / self.fan_in), size=size)
+		return np.random.normal(0, math.sqrt(2 / self.fan_in), size=size).astype(self.dtype, copy=False)
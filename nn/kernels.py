@@ -0,0 +1,168 @@
+"""
+Compiled kernels for the hot loops in nn/operators.py.
+
+numba is optional: without it, has_numba is False, the functions below are
+plain (slow) Python and the operators keep their NumPy implementations.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+    has_numba = True
+except ImportError:
+    has_numba = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def conv2d_direct(X_pad, W, b, s, out):
+    """Direct convolution, one output row is accumulated at a time in a small array that stays in cache
+
+    # Arguments
+        X_pad: padded input array with shape (batch, in_channel, height, width)
+        W: weights with shape (out_channel, in_channel, kernel_h, kernel_w)
+        b: bias with shape (out_channel)
+        s: stride length
+        out: output array with shape (batch, out_channel, out_height, out_width), filled in place
+    """
+    C = X_pad.shape[1]
+    OC, _, KH, KW = W.shape
+    N, _, OH, OW = out.shape
+    for nc in prange(N * OC):
+        n = nc // OC
+        oc = nc % OC
+        acc = np.empty(OW, dtype=out.dtype)
+        for oh in range(OH):
+            acc[:] = b[oc]
+            for ic in range(C):
+                for kh in range(KH):
+                    src = X_pad[n, ic, oh * s + kh]
+                    for kw in range(KW):
+                        w = W[oc, ic, kh, kw]
+                        # fixed loop bounds (the padding is real zeros) and a unit stride let the innermost loop vectorize
+                        if s == 1:
+                            for ow in range(OW):
+                                acc[ow] += w * src[ow + kw]
+                        else:
+                            for ow in range(OW):
+                                acc[ow] += w * src[ow * s + kw]
+            out[n, oc, oh] = acc
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def col2im_accumulate(cols, s, out):
+    """Scatter-add receptive fields back onto the (padded) input grid, the inverse of img2col
+
+    # Arguments
+        cols: array with shape (batch, channel, kernel_h, kernel_w, out_height, out_width)
+        s: stride length
+        out: padded gradient array with shape (batch, channel, height, width), accumulated in place
+    """
+    N, C, KH, KW, OH, OW = cols.shape
+    for nc in prange(N * C):
+        n = nc // C
+        c = nc % C
+        plane = out[n, c]
+        for kh in range(KH):
+            for kw in range(KW):
+                for oh in range(OH):
+                    src = cols[n, c, kh, kw, oh]
+                    dst = plane[oh * s + kh]
+                    for ow in range(OW):
+                        dst[ow * s + kw] += src[ow]
+
+
+@njit(parallel=True, cache=True)
+def relu_backward(out_grad, input, out):
+    """Single-pass relu gradient on flattened arrays: out = out_grad where input >= 0, else 0
+
+    # Arguments
+        out_grad: 1-D array, gradient to the relu output
+        input: 1-D array, same size as out_grad, the relu input
+        out: 1-D array, same size as out_grad, filled in place
+    """
+    for i in prange(out.size):
+        if input[i] >= 0:
+            out[i] = out_grad[i]
+        else:
+            out[i] = 0
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def winograd_input_transform(X_pad, th, tw, V):
+    """Winograd F(2x2, 3x3) input transform B^T d B of every overlapping 4x4 tile (stride 2)
+
+    # Arguments
+        X_pad: padded input with shape (batch, channel, 2 * th + 2, 2 * tw + 2)
+        th: number of tile rows
+        tw: number of tile columns
+        V: array with shape (batch, channel, 16, th * tw), filled in place
+    """
+    N, C = X_pad.shape[0], X_pad.shape[1]
+    for nc in prange(N * C):
+        n = nc // C
+        c = nc % C
+        img = X_pad[n, c]
+        out = V[n, c]
+        for t in range(th):
+            r0 = img[2 * t]
+            r1 = img[2 * t + 1]
+            r2 = img[2 * t + 2]
+            r3 = img[2 * t + 3]
+            for u in range(tw):
+                j = 2 * u
+                col = t * tw + u
+                # B^T d
+                d00 = r0[j] - r2[j]; d01 = r0[j + 1] - r2[j + 1]; d02 = r0[j + 2] - r2[j + 2]; d03 = r0[j + 3] - r2[j + 3]
+                d10 = r1[j] + r2[j]; d11 = r1[j + 1] + r2[j + 1]; d12 = r1[j + 2] + r2[j + 2]; d13 = r1[j + 3] + r2[j + 3]
+                d20 = r2[j] - r1[j]; d21 = r2[j + 1] - r1[j + 1]; d22 = r2[j + 2] - r1[j + 2]; d23 = r2[j + 3] - r1[j + 3]
+                d30 = r1[j] - r3[j]; d31 = r1[j + 1] - r3[j + 1]; d32 = r1[j + 2] - r3[j + 2]; d33 = r1[j + 3] - r3[j + 3]
+                # (B^T d) B
+                out[0, col] = d00 - d02; out[1, col] = d01 + d02; out[2, col] = d02 - d01; out[3, col] = d01 - d03
+                out[4, col] = d10 - d12; out[5, col] = d11 + d12; out[6, col] = d12 - d11; out[7, col] = d11 - d13
+                out[8, col] = d20 - d22; out[9, col] = d21 + d22; out[10, col] = d22 - d21; out[11, col] = d21 - d23
+                out[12, col] = d30 - d32; out[13, col] = d31 + d32; out[14, col] = d32 - d31; out[15, col] = d31 - d33
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def winograd_output_transform(M, b, th, tw, out):
+    """Winograd F(2x2, 3x3) output transform A^T m A of every tile, plus bias, cropped to the output size
+
+    # Arguments
+        M: transformed products with shape (16, batch, out_channel, th * tw)
+        b: bias with shape (out_channel)
+        th: number of tile rows
+        tw: number of tile columns
+        out: output array with shape (batch, out_channel, out_height, out_width), filled in place
+    """
+    N, OC, OH, OW = out.shape
+    for no in prange(N * OC):
+        n = no // OC
+        oc = no % OC
+        plane = out[n, oc]
+        bias = b[oc]
+        for t in range(th):
+            for u in range(tw):
+                col = t * tw + u
+                m00 = M[0, n, oc, col]; m01 = M[1, n, oc, col]; m02 = M[2, n, oc, col]; m03 = M[3, n, oc, col]
+                m10 = M[4, n, oc, col]; m11 = M[5, n, oc, col]; m12 = M[6, n, oc, col]; m13 = M[7, n, oc, col]
+                m20 = M[8, n, oc, col]; m21 = M[9, n, oc, col]; m22 = M[10, n, oc, col]; m23 = M[11, n, oc, col]
+                m30 = M[12, n, oc, col]; m31 = M[13, n, oc, col]; m32 = M[14, n, oc, col]; m33 = M[15, n, oc, col]
+                # A^T m
+                a0 = m00 + m10 + m20; a1 = m01 + m11 + m21; a2 = m02 + m12 + m22; a3 = m03 + m13 + m23
+                c0 = m10 - m20 - m30; c1 = m11 - m21 - m31; c2 = m12 - m22 - m32; c3 = m13 - m23 - m33
+                # (A^T m) A, the last tile row/column may overhang an odd output size
+                h = 2 * t
+                w = 2 * u
+                plane[h, w] = a0 + a1 + a2 + bias
+                if w + 1 < OW:
+                    plane[h, w + 1] = a1 - a2 - a3 + bias
+                if h + 1 < OH:
+                    plane[h + 1, w] = c0 + c1 + c2 + bias
+                    if w + 1 < OW:
+                        plane[h + 1, w + 1] = c1 - c2 - c3 + bias
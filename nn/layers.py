@@ -43,6 +43,11 @@ class Layer(object):
 # following layers are mainly for RNN
 
 
+def all_equal(cached, arrays):
+    """Whether each array still has the values of its cached copy, NaN (padding) compares equal"""
+    return all(np.array_equal(c, a, equal_nan=True) for c, a in zip(cached, arrays))
+
+
 class Linear(Layer):
     def __init__(self, in_features, out_features, name='linear', initializer=Gaussian()):
         """Initialization
@@ -58,10 +63,10 @@ class Linear(Layer):
         self.trainable = True
 
         self.weights = initializer.initialize((in_features, out_features))
-        self.bias = np.zeros(out_features)
+        self.bias = np.zeros(out_features, dtype=self.weights.dtype)
 
-        self.w_grad = np.zeros(self.weights.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+        self.w_grad = np.zeros_like(self.weights)
+        self.b_grad = np.zeros_like(self.bias)
 
     def forward(self, input):
         output = self.linear.forward(input, self.weights, self.bias)
@@ -125,6 +130,7 @@ class Conv2D(Layer):
                 'pad': The total number of 0s to be added along the height (or width) dimension; half of the 0s are added on the top (or left) and half at the bottom (or right). we will only test even numbers.
                 'in_channel': The number of input channels.
                 'out_channel': The number of output channels.
+                'algorithm': Optional, 'im2col' (default), 'direct', 'winograd' or 'torch', see nn.operators.conv.
             initializer: Initializer class, to initialize weights
         """
         super(Conv2D, self).__init__(name=name)
@@ -135,10 +141,10 @@ class Conv2D(Layer):
 
         self.weights = initializer.initialize(
             (conv_params['out_channel'], conv_params['in_channel'], conv_params['kernel_h'], conv_params['kernel_w']))
-        self.bias = np.zeros((conv_params['out_channel']))
+        self.bias = np.zeros(conv_params['out_channel'], dtype=self.weights.dtype)
 
-        self.w_grad = np.zeros(self.weights.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+        self.w_grad = np.zeros_like(self.weights)
+        self.b_grad = np.zeros_like(self.bias)
 
     def forward(self, input):
         output = self.conv.forward(input, self.weights, self.bias)
@@ -324,10 +330,10 @@ class Linear2D(Layer):
         self.trainable = True
 
         self.weights = initializer.initialize((in_features, out_features))
-        self.bias = np.zeros(out_features)
+        self.bias = np.zeros(out_features, dtype=self.weights.dtype)
 
-        self.w_grad = np.zeros(self.weights.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+        self.w_grad = np.zeros_like(self.weights)
+        self.b_grad = np.zeros_like(self.bias)
 
     def forward(self, input):
         """Forward pass
@@ -337,11 +343,12 @@ class Linear2D(Layer):
         # Returns
             output: numpy array with shape (batch, ..., out_features)
         """
-        batch = input.shape[0]
-        b_reshaped = self.bias.reshape(
-            (1,) * (input.ndim - 1) + self.bias.shape)
-        output = np.dot(input, self.weights) + b_reshaped
-        return output
+        # Collapse the leading axes so that a single 2D GEMM does the work,
+        # np.dot on N-D input does not go through BLAS
+        input_2d = input.reshape(-1, input.shape[-1])
+        output = np.dot(input_2d, self.weights)
+        output += self.bias
+        return output.reshape(input.shape[:-1] + self.bias.shape)
 
     def backward(self, out_grad, input):
         """Backward pass, store gradients to self.weights into self.w_grad and store gradients to self.bias into self.b_grad
@@ -351,12 +358,13 @@ class Linear2D(Layer):
         # Returns
             in_grad: numpy array with shape (batch, ..., in_features), gradients to input
         """
-        dot_axes = np.arange(input.ndim - 1)
-        self.w_grad = np.tensordot(np.nan_to_num(
-            input), out_grad, axes=(dot_axes, dot_axes))
-        self.b_grad = np.sum(out_grad, axis=tuple(dot_axes))
-        in_grad = np.dot(out_grad, self.weights.T)
-        return in_grad
+        input_2d = np.nan_to_num(input).reshape(-1, input.shape[-1])
+        out_grad_2d = out_grad.reshape(-1, out_grad.shape[-1])
+        # Transposed views are passed to BLAS as transpose flags, no copies are made
+        self.w_grad = np.dot(input_2d.T, out_grad_2d)
+        self.b_grad = np.sum(out_grad_2d, axis=0)
+        in_grad = np.dot(out_grad_2d, self.weights.T)
+        return in_grad.reshape(input.shape)
 
     def update(self, params):
         """Update parameters (self.weights and self.bias) with new params
@@ -394,6 +402,80 @@ class Linear2D(Layer):
             return None
 
 
+class Embedding(Layer):
+    def __init__(self, vocab_size, embedding_dim, name='embedding', initializer=Gaussian()):
+        """Initialization, equivalent to Linear2D(vocab_size, embedding_dim) without bias on one-hot input
+        # Arguments
+            vocab_size: int, the number of words in the dictionary
+            embedding_dim: int, the size of each word vector
+            initializer: Initializer class, to initialize weights
+        """
+        super(Embedding, self).__init__(name=name)
+        self.trainable = True
+
+        self.weights = initializer.initialize((vocab_size, embedding_dim))
+
+        self.w_grad = np.zeros_like(self.weights)
+
+    def forward(self, input):
+        """Forward pass, a row lookup instead of the one-hot matrix product
+        # Arguments
+            input: int numpy array with shape (batch, T), word ids in [1, vocab_size], 0 for padding
+        # Returns
+            output: numpy array with shape (batch, T, embedding_dim), NaN at the padding steps
+        """
+        mask = input > 0
+        output = self.weights[np.where(mask, input - 1, 0)]
+        output[~mask] = np.nan
+        return output
+
+    def backward(self, out_grad, input):
+        """Backward pass, store gradients to self.weights into self.w_grad
+        # Arguments
+            out_grad: numpy array with shape (batch, T, embedding_dim), gradients to output
+            input: int numpy array with shape (batch, T), same with forward input
+        # Returns
+            in_grad: zeros with shape (batch, T), word ids are not differentiable
+        """
+        mask = input > 0
+        self.w_grad = np.zeros_like(self.weights)
+        # Repeated words accumulate into the same row
+        np.add.at(self.w_grad, input[mask] - 1, out_grad[mask])
+        in_grad = np.zeros(input.shape)
+        return in_grad
+
+    def update(self, params):
+        """Update parameters (self.weights) with new params
+        # Arguments
+            params: dictionary, the key contains 'weights'
+        # Returns
+            none
+        """
+        for k, v in params.items():
+            if 'weights' in k:
+                self.weights = v
+
+    def get_params(self, prefix):
+        """Return parameters (self.weights) as well as gradients (self.w_grad)
+        # Arguments
+            prefix: string, to contruct prefix of keys in the dictionary (usually is the layer-ith)
+        # Returns
+            params: dictionary, store parameters of this layer, the key contains 'weights'
+            grads: dictionary, store gradients of this layer, the key contains 'weights'
+            None: if not trainable
+        """
+        if self.trainable:
+            params = {
+                prefix + ':' + self.name + '/weights': self.weights
+            }
+            grads = {
+                prefix + ':' + self.name + '/weights': self.w_grad
+            }
+            return params, grads
+        else:
+            return None
+
+
 class TemporalPooling(Layer):
     """
     Temporal mean-pooling that ignores NaN
@@ -436,12 +518,11 @@ class TemporalPooling(Layer):
         # Returns
             in_grad: numpy array with shape (batch, time_steps, units), gradients to input
         """
-        batch, time_steps, units = input.shape
         mask = ~np.any(np.isnan(input), axis=2)
         out_grad = out_grad/np.sum(mask, axis=1, keepdims=True)
-        in_grad = np.repeat(out_grad, time_steps, 1).reshape(
-            (batch, units, time_steps)).transpose(0, 2, 1)
-        in_grad *= ~np.isnan(input)
+        # Broadcast the gradient over the time steps as a view, instead of repeating it into a
+        # transposed copy, the masking multiply then writes the only (contiguous) full size array
+        in_grad = out_grad[:, np.newaxis, :] * ~np.isnan(input)
         return in_grad
 
 
@@ -458,14 +539,16 @@ class VanillaRNNCell(Layer):
         super(VanillaRNNCell, self).__init__(name=name)
         self.trainable = True
         self.cell = vanilla_rnn()
+        # (copies of input and weights, output) of the last forward, reused by backward
+        self._cache = None
 
         self.kernel = initializer.initialize((in_features, units))
         self.recurrent_kernel = initializer.initialize((units, units))
-        self.bias = np.zeros(units)
+        self.bias = np.zeros(units, dtype=self.kernel.dtype)
 
-        self.kernel_grad = np.zeros(self.kernel.shape)
-        self.r_kernel_grad = np.zeros(self.recurrent_kernel.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+        self.kernel_grad = np.zeros_like(self.kernel)
+        self.r_kernel_grad = np.zeros_like(self.recurrent_kernel)
+        self.b_grad = np.zeros_like(self.bias)
 
     def forward(self, input):
         """
@@ -478,6 +561,7 @@ class VanillaRNNCell(Layer):
         """
         output = self.cell.forward(
             input, self.kernel, self.recurrent_kernel, self.bias)
+        self._cache = ([a.copy() for a in (*input, self.kernel, self.recurrent_kernel, self.bias)], output)
         return output
 
     def backward(self, out_grad, input):
@@ -491,8 +575,11 @@ class VanillaRNNCell(Layer):
             in_grad: [gradients to input numpy array with shape (batch, in_features),
                         gradients to state numpy array with shape (batch, units)]
         """
+        output = None
+        if self._cache is not None and all_equal(self._cache[0], (*input, self.kernel, self.recurrent_kernel, self.bias)):
+            output = self._cache[1]
         in_grad, self.kernel_grad, self.r_kernel_grad, self.b_grad = self.cell.backward(
-            out_grad, input, self.kernel, self.recurrent_kernel, self.bias)
+            out_grad, input, self.kernel, self.recurrent_kernel, self.bias, output=output)
         return in_grad
 
     def update(self, params):
@@ -545,19 +632,21 @@ class VanillaRNN(Layer):
         super(VanillaRNN, self).__init__(name=name)
         self.trainable = True
         self.cell = vanilla_rnn()  # it's operation instead of layer
+        # (copies of input and weights, output) of the last forward, reused by backward
+        self._cache = None
 
         self.kernel = initializer.initialize((in_features, units))
         self.recurrent_kernel = initializer.initialize((units, units))
-        self.bias = np.zeros(units)
+        self.bias = np.zeros(units, dtype=self.kernel.dtype)
 
         if h0 is None:
             self.h0 = np.zeros_like(self.bias)
         else:
             self.h0 = h0
 
-        self.kernel_grad = np.zeros(self.kernel.shape)
-        self.r_kernel_grad = np.zeros(self.recurrent_kernel.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+        self.kernel_grad = np.zeros_like(self.kernel)
+        self.r_kernel_grad = np.zeros_like(self.recurrent_kernel)
+        self.b_grad = np.zeros_like(self.bias)
 
     def forward(self, input):
         """
@@ -576,6 +665,7 @@ class VanillaRNN(Layer):
             output.append(out)
             h = out
         output = np.stack(output, axis=1)
+        self._cache = ([a.copy() for a in (input, self.kernel, self.recurrent_kernel, self.bias)], output)
         return output
 
     def backward(self, out_grad, input):
@@ -587,7 +677,11 @@ class VanillaRNN(Layer):
         # Returns
             in_grad: gradient to forward pass input with shape (batch, timestamp, in_features)
         """
-        output = self.forward(input)
+        # The hidden states of forward are reused while the input and weights are unchanged
+        if self._cache is not None and all_equal(self._cache[0], (input, self.kernel, self.recurrent_kernel, self.bias)):
+            output = self._cache[1]
+        else:
+            output = self.forward(input)
         in_grad = []
         h_grad = np.zeros_like(self.h0) # will be broadcast during backpropogation
 
@@ -600,7 +694,8 @@ class VanillaRNN(Layer):
             else:
                 h = output[:, t-1, :]
             grad, kernel_grad, r_kernel_grad, b_grad = self.cell.backward(
-                out_grad[:, t, :]+h_grad, [input[:, t, :], h], self.kernel, self.recurrent_kernel, self.bias)
+                out_grad[:, t, :]+h_grad, [input[:, t, :], h], self.kernel, self.recurrent_kernel, self.bias,
+                output=output[:, t, :])
             self.kernel_grad += kernel_grad
             self.r_kernel_grad += r_kernel_grad
             self.b_grad += b_grad
@@ -662,12 +757,14 @@ class GRUCell(Layer):
         super(GRUCell, self).__init__(name=name)
         self.trainable = True
         self.cell = gru()
+        # (copies of input and weights, gates) of the last forward, reused by backward
+        self._cache = None
 
         self.kernel = initializer.initialize((in_features, 3 * units))
         self.recurrent_kernel = initializer.initialize((units, 3 * units))
 
-        self.kernel_grad = np.zeros(self.kernel.shape)
-        self.r_kernel_grad = np.zeros(self.recurrent_kernel.shape)
+        self.kernel_grad = np.zeros_like(self.kernel)
+        self.r_kernel_grad = np.zeros_like(self.recurrent_kernel)
 
     def forward(self, input):
         """
@@ -678,7 +775,8 @@ class GRUCell(Layer):
         # Returns
             output: numpy array with shape (batch, units)
         """
-        output = self.cell.forward(input, self.kernel, self.recurrent_kernel)
+        output, gates = self.cell.forward(input, self.kernel, self.recurrent_kernel, return_gates=True)
+        self._cache = ([a.copy() for a in (*input, self.kernel, self.recurrent_kernel)], gates)
         return output
 
     def backward(self, out_grad, input):
@@ -692,8 +790,11 @@ class GRUCell(Layer):
             in_grad: [gradients to input numpy array with shape (batch, in_features),
                         gradients to state numpy array with shape (batch, units)]
         """
+        gates = None
+        if self._cache is not None and all_equal(self._cache[0], (*input, self.kernel, self.recurrent_kernel)):
+            gates = self._cache[1]
         in_grad, self.kernel_grad, self.r_kernel_grad= self.cell.backward(
-            out_grad, input, self.kernel, self.recurrent_kernel)
+            out_grad, input, self.kernel, self.recurrent_kernel, gates=gates)
         return in_grad
 
     def update(self, params):
@@ -742,17 +843,19 @@ class GRU(Layer):
         super(GRU, self).__init__(name=name)
         self.trainable = True
         self.cell = gru()  # it's operation instead of layer
+        # (copies of input and weights, output, gates of every step) of the last forward, reused by backward
+        self._cache = None
 
         self.kernel = initializer.initialize((in_features, 3 * units))
         self.recurrent_kernel = initializer.initialize((units, 3 * units))
 
         if h0 is None:
-            self.h0 = np.zeros(units)
+            self.h0 = np.zeros(units, dtype=self.kernel.dtype)
         else:
             self.h0 = h0
 
-        self.kernel_grad = np.zeros(self.kernel.shape)
-        self.r_kernel_grad = np.zeros(self.recurrent_kernel.shape)
+        self.kernel_grad = np.zeros_like(self.kernel)
+        self.r_kernel_grad = np.zeros_like(self.recurrent_kernel)
 
     def forward(self, input):
         """
@@ -763,14 +866,17 @@ class GRU(Layer):
             output: numpy array with shape (batch, timestamp, units)
         """
         output = []
+        gates = []
         batch, _, _ = input.shape
         h = np.repeat(self.h0[None,:], batch, axis=0)
         for t in range(input.shape[1]):
-            out = self.cell.forward(
-                [input[:, t, :], h], self.kernel, self.recurrent_kernel)
+            out, step_gates = self.cell.forward(
+                [input[:, t, :], h], self.kernel, self.recurrent_kernel, return_gates=True)
             output.append(out)
+            gates.append(step_gates)
             h = out
         output = np.stack(output, axis=1)
+        self._cache = ([a.copy() for a in (input, self.kernel, self.recurrent_kernel)], output, gates)
         return output
 
     def backward(self, out_grad, input):
@@ -782,7 +888,10 @@ class GRU(Layer):
         # Returns
             in_grad: gradient to forward pass input with shape (batch, timestamp, in_features)
         """
-        output = self.forward(input)
+        # The hidden states and gates of forward are reused while the input and weights are unchanged
+        if self._cache is None or not all_equal(self._cache[0], (input, self.kernel, self.recurrent_kernel)):
+            self.forward(input)
+        _, output, gates = self._cache
         in_grad = []
         h_grad = np.zeros_like(self.h0) # will be broadcast during backpropogation
 
@@ -795,7 +904,7 @@ class GRU(Layer):
             else:
                 h = output[:, t-1, :]
             grad, kernel_grad, r_kernel_grad = self.cell.backward(
-                out_grad[:, t, :]+h_grad, [input[:, t, :], h], self.kernel, self.recurrent_kernel)
+                out_grad[:, t, :]+h_grad, [input[:, t, :], h], self.kernel, self.recurrent_kernel, gates=gates[t])
             self.kernel_grad += kernel_grad
             self.r_kernel_grad += r_kernel_grad
             in_grad.append(grad[0])
@@ -81,5 +81,5 @@ class L2(Loss):
             if 'weights' in k:
                 in_grad[k] = self.w * params[k]
             else:
-                in_grad[k] = np.zeros(v.shape)
+                in_grad[k] = np.zeros_like(v)
         return in_grad
@@ -1,10 +1,16 @@
+import importlib.util
 import numpy as np
 
 from utils.tools import *
 from nn.functional import sigmoid, img2col
+from nn.kernels import has_numba, conv2d_direct, col2im_accumulate, relu_backward, \
+    winograd_input_transform, winograd_output_transform
 # Attension:
 # - Never change the value of input, which will change the result of backward
 
+# torch is optional, it is only imported by conv layers with 'algorithm': 'torch'
+has_torch = importlib.util.find_spec('torch') is not None
+
 
 class operator(object):
     """
@@ -19,6 +25,34 @@ class operator(object):
         """Backward operation, return gradient to input"""
         raise NotImplementedError
 
+    def get_buffer(self, name, shape, dtype=np.float64):
+        """Scratch array kept across calls, reallocated (zero filled) only when shape or dtype change.
+        Never return it as an output, the next call will overwrite it"""
+        if not hasattr(self, '_buffers'):
+            self._buffers = {}
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.zeros(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+
+# Transient arrays shared by all operators, see get_scratch
+_scratch = {}
+
+
+def get_scratch(name, shape, dtype=np.float64):
+    """Scratch array shared by all operator instances, the memory is only reallocated when a larger one is requested.
+    The content is undefined and the next operator asking for the same name overwrites it, so it must not outlive the call
+    (unlike operator.get_buffer, which is private to one operator)"""
+    size = int(np.prod(shape))
+    key = (name, np.dtype(dtype))
+    buf = _scratch.get(key)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=dtype)
+        _scratch[key] = buf
+    return buf[:size].reshape(shape)
+
 
 class relu(operator):
     def __init__(self):
@@ -29,7 +63,13 @@ class relu(operator):
         return output
 
     def backward(self, out_grad, input):
-        in_grad = (input >= 0) * out_grad
+        if has_numba:
+            # One streaming pass, without the intermediate boolean mask
+            in_grad = np.empty(out_grad.shape, dtype=out_grad.dtype)
+            relu_backward(out_grad.ravel(), input.ravel(), in_grad.ravel())
+        else:
+            # The mask multiply is a fast vectorized loop, np.where(input >= 0, out_grad, 0) is about 3x slower
+            in_grad = (input >= 0) * out_grad
         return in_grad
 
 
@@ -39,11 +79,12 @@ class flatten(operator):
 
     def forward(self, input):
         batch = input.shape[0]
-        output = input.copy().reshape(batch, -1)
+        # A view whenever possible, no layer writes to its input
+        output = input.reshape(batch, -1)
         return output
 
     def backward(self, out_grad, input):
-        in_grad = out_grad.copy().reshape(input.shape)
+        in_grad = out_grad.reshape(input.shape)
         return in_grad
 
 
@@ -124,9 +165,11 @@ class linear(operator):
         # Returns
             output: numpy array with shape(batch, out_features)
         """
-        output = self.matmul.forward(input, weights)
-        output = self.add_bias.forward(output, bias)
-        # output = np.matmul(input, weights) + bias.reshape(1, -1)
+        # Same as add_bias.forward(matmul.forward(input, weights), bias), but the GEMM writes straight
+        # into the output and the bias is added in place, without a second (batch, out_features) temporary
+        output = np.empty((input.shape[0], weights.shape[1]), dtype=get_float_dtype(input, weights, bias))
+        np.matmul(input, weights, out=output)
+        output += bias
         return output
 
     def backward(self, out_grad, input, weights, bias):
@@ -164,6 +207,36 @@ def get_output_size(n, k, p, s):
     return int(np.floor((n + p - k) / s) + 1)
 
 
+def get_valid_range(n, o, p, k, s):
+    """
+    # Arguments
+        n: input size
+        o: output size
+        p: padding on one side
+        k: offset inside the kernel
+        s: stride
+
+    # Returns
+        lo, hi: outputs in [lo, hi) read a real input value (not padding) at kernel offset k
+        start: input index read by output lo
+    """
+    lo = min(o, max(0, -((k - p) // s)))
+    hi = max(lo, min(o, (n - 1 + p - k) // s + 1))
+    return lo, hi, lo * s + k - p
+
+
+def get_float_dtype(*arrays):
+    """
+    # Arguments
+        arrays: operands of a computation
+
+    # Returns
+        dtype: their common dtype when it is floating (float32 stays float32), float64 otherwise (e.g. uint8 images)
+    """
+    dtype = np.result_type(*arrays)
+    return dtype if dtype.kind == 'f' else np.dtype(np.float64)
+
+
 class conv(operator):
     def __init__(self, conv_params):
         """
@@ -175,9 +248,16 @@ class conv(operator):
                 'pad': The total number of 0s to be added along the height (or width) dimension; half of the 0s are added on the top (or left) and half at the bottom (or right). we will only test even numbers.
                 'in_channel': The number of input channels.
                 'out_channel': The number of output channels.
+                'algorithm': Optional, 'im2col' (default), 'direct', 'winograd' or 'torch', unavailable ones fall back to 'im2col'.
+                    'direct' and 'winograd' only change forward and need numba. 'direct' runs a numba compiled direct convolution without img2col columns, it is only on par with the BLAS GEMM for single channel inputs. 'winograd' applies to 3x3 stride 1 kernels, it needs 2.25x fewer multiplications and speeds up forward of layers with 32+ input channels, but backward then has to build the img2col columns itself, so it suits inference more than training.
+                    'torch' runs forward and backward with torch's conv2d kernels, it needs torch to be installed.
         """
         super(conv, self).__init__()
         self.conv_params = conv_params
+        # (input, X_hat) of the last forward, reused by backward
+        self._cache = None
+        # Index arrays only depend on the shapes, they are built once per input shape
+        self._idx_cache = {}
 
 
     def get_im2col_data_indexes(self, N, c_i, n_h, n_w, k_h, k_w, p, s, o_h, o_w):
@@ -199,31 +279,27 @@ class conv(operator):
             height_idxs: indices of the input height in the img2col array cell
             width_ixds: indices of the input width in the img2col array cell
         """
-        # Indices of the channel for each row in the output reshaped batch data
-        channel_idxs = np.repeat(np.arange(c_i), k_h * k_w).reshape(-1, 1)
+        key = (c_i, n_h, n_w, k_h, k_w, p, s)
+        if key in self._idx_cache:
+            return self._idx_cache[key]
 
-        # Indices of heights of a single receptive field for all channels
-        k_height_idxs = np.repeat(np.arange(k_h), k_w)
-        k_height_idxs = np.tile(k_height_idxs, c_i)
-        # Offsets for heights of receptive fields
-        height_offsets = np.repeat(np.arange(o_h), o_w) * s
+        # Indices of the channel and kernel offsets for each row in the output reshaped batch data (channel major)
+        channel_idxs, k_heights, k_widths = (idxs.reshape(-1, 1) for idxs in np.mgrid[:c_i, :k_h, :k_w])
+        # Offsets of the receptive field of each column
+        o_heights, o_widths = (idxs.reshape(1, -1) * s for idxs in np.mgrid[:o_h, :o_w])
 
-        height_idxs = k_height_idxs.reshape(-1, 1) + height_offsets.reshape(1, -1)
+        # Indices of heights and widths of every receptive field, kernel offset plus the offset of the field
+        height_idxs = k_heights + o_heights
+        width_ixds = k_widths + o_widths
 
+        self._idx_cache[key] = tuple(np.ascontiguousarray(idxs, dtype=np.intp) for idxs in (channel_idxs, height_idxs, width_ixds))
+        return self._idx_cache[key]
 
-        # Indices of widths of a single receptive field for all channels
-        k_width_idxs = np.tile(np.arange(k_w), k_h * c_i)
-        width_offsets = np.tile(np.arange(o_w), o_h) * s
 
-        width_ixds = k_width_idxs.reshape(-1, 1) + width_offsets.reshape(1, -1)
-        
-        return channel_idxs, height_idxs, width_ixds
-
-
-    def img2col(self, X, N, c_i, n_h, n_w, k_h, k_w, p, s):
+    def img2col(self, X, N, c_i, n_h, n_w, k_h, k_w, p, s, dtype=np.float64):
         """
         # Arguments
-            X: padded input array
+            X: input array, without padding
             N: batch size (number of instances)
             c_i: number of input channels
             n_h: input height
@@ -232,24 +308,140 @@ class conv(operator):
             k_w: kernel width
             p: total padding
             s: stride length
+            dtype: dtype of X_hat
 
         # Returns
-            X_hat: img2col representation of input of conv layer
+            X_hat: img2col representation of input of conv layer, with shape (N, c_i * k_h * k_w, o_h * o_w)
             o_h: height of output
             o_w: width of output
         """
         o_h = get_output_size(n_h, k_h, p, s)
         o_w = get_output_size(n_w, k_w, p, s)
 
-        channel_idxs, height_idxs, width_ixds = self.get_im2col_data_indexes(N, c_i, n_h, n_w, k_h, k_w, p, s, o_h, o_w)
-
-        X_hat_batch = X[:, channel_idxs, height_idxs, width_ixds]
-        # Combine the batch instances into a single matrix
-        X_hat = X_hat_batch.transpose(1, 2, 0).reshape(k_h * k_w * c_i, -1)
+        if k_h == 1 and k_w == 1 and p == 0:
+            # Pointwise convolution, the (subsampled) input already is its own img2col matrix
+            return X[:, :, ::s, ::s].reshape(N, c_i, -1), o_h, o_w
+
+        # Reused across calls, the columns are only needed until the end of forward (or backward)
+        X_hat_batch = self.get_buffer('X_hat', (N, c_i, k_h, k_w, o_h, o_w), dtype)
+        if p == 0:
+            # Copy from a strided view of all receptive fields
+            img2col(X, k_h, k_w, s, out=X_hat_batch)
+        elif s == 1:
+            # Dense receptive fields: padding once and copying the strided view in a single pass
+            # beats the per-offset slicing below. The border of the buffer is never written, so it stays zero
+            X_pad = self.get_buffer('X_pad_cols', (N, c_i, n_h + p, n_w + p), dtype)
+            X_pad[:, :, p // 2:p // 2 + n_h, p // 2:p // 2 + n_w] = X
+            img2col(X_pad, k_h, k_w, s, out=X_hat_batch)
+        else:
+            # Copy every kernel offset straight from X and write the zero padding into
+            # X_hat_batch itself, instead of materializing a padded copy of X first
+            rows = [get_valid_range(n_h, o_h, p // 2, i, s) for i in range(k_h)]
+            cols = [get_valid_range(n_w, o_w, p // 2, j, s) for j in range(k_w)]
+            for i, (h_lo, h_hi, h_start) in enumerate(rows):
+                for j, (w_lo, w_hi, w_start) in enumerate(cols):
+                    fields = X_hat_batch[:, :, i, j]
+                    fields[:, :, :h_lo] = 0
+                    fields[:, :, h_hi:] = 0
+                    fields[:, :, h_lo:h_hi, :w_lo] = 0
+                    fields[:, :, h_lo:h_hi, w_hi:] = 0
+                    if h_lo < h_hi and w_lo < w_hi:
+                        fields[:, :, h_lo:h_hi, w_lo:w_hi] = X[:, :,
+                            h_start:h_start + (h_hi - h_lo) * s:s,
+                            w_start:w_start + (w_hi - w_lo) * s:s]
+        # One matrix per batch instance, so that a single batched GEMM covers the whole batch
+        X_hat = X_hat_batch.reshape(N, k_h * k_w * c_i, -1)
 
         return X_hat, o_h, o_w
 
 
+    def winograd(self, input, weights, bias):
+        """Winograd F(2x2, 3x3) convolution, for 3x3 kernels with stride 1
+
+        # Arguments
+            input: numpy array with shape (batch, in_channel, in_height, in_width)
+            weights: numpy array with shape (out_channel, in_channel, 3, 3)
+            bias: numpy array with shape (out_channel)
+
+        # Returns
+            output: numpy array with shape (batch, out_channel, out_height, out_width)
+        """
+        pad = self.conv_params['pad']
+        batch, in_channel, in_height, in_width = input.shape
+        out_channel = weights.shape[0]
+        out_height = get_output_size(in_height, 3, pad, 1)
+        out_width = get_output_size(in_width, 3, pad, 1)
+        dtype = get_float_dtype(input, weights)
+
+        # Every 2x2 output tile reads a 4x4 input tile, the padding is rounded up to whole tiles.
+        # Only the interior of the buffer is ever written, its zero border is kept across calls
+        th, tw = (out_height + 1) // 2, (out_width + 1) // 2
+        X_pad = self.get_buffer('X_pad', (batch, in_channel, 2 * th + 2, 2 * tw + 2), dtype)
+        X_pad[:, :, pad // 2:pad // 2 + in_height, pad // 2:pad // 2 + in_width] = input
+
+        V = get_scratch('V', (batch, in_channel, 16, th * tw), dtype)
+        winograd_input_transform(X_pad, th, tw, V)
+
+        # Filter transform G g G^T, laid out as 16 (out_channel, in_channel) matrices
+        G = np.array([[1, 0, 0], [0.5, 0.5, 0.5], [0.5, -0.5, 0.5], [0, 0, 1]], dtype=dtype)
+        U = np.matmul(np.matmul(G, weights), G.T).transpose(2, 3, 0, 1).reshape(16, 1, out_channel, in_channel)
+
+        # One GEMM per tile element and batch instance, the elementwise products of all tiles at once
+        M = get_scratch('M', (16, batch, out_channel, th * tw), dtype)
+        np.matmul(U, V.transpose(2, 0, 1, 3), out=M)
+
+        output = np.empty((batch, out_channel, out_height, out_width), dtype=get_float_dtype(M, bias))
+        winograd_output_transform(M, bias, th, tw, output)
+        return output
+
+
+    def torch_forward(self, input, weights, bias):
+        """Forward with torch.nn.functional.conv2d, the arrays are shared with torch tensors without copying
+
+        # Arguments
+            input: numpy array with shape (batch, in_channel, in_height, in_width)
+            weights: numpy array with shape (out_channel, in_channel, kernel_h, kernel_w)
+            bias: numpy array with shape (out_channel)
+
+        # Returns
+            output: numpy array with shape (batch, out_channel, out_height, out_width)
+        """
+        import torch
+
+        # torch wants a single floating dtype, arrays already in it are not copied
+        dtype = get_float_dtype(input, weights)
+        x = torch.from_numpy(np.ascontiguousarray(input, dtype=dtype))
+        w = torch.from_numpy(np.ascontiguousarray(weights, dtype=dtype))
+        b = torch.from_numpy(np.ascontiguousarray(bias, dtype=dtype))
+        output = torch.nn.functional.conv2d(x, w, b, stride=self.conv_params['stride'], padding=self.conv_params['pad'] // 2)
+        return output.numpy()
+
+
+    def torch_backward(self, out_grad, input, weights):
+        """Backward with torch.nn.grad, see torch_forward
+
+        # Arguments
+            out_grad: gradient to the forward output of conv layer, with shape (batch, out_channel, out_height, out_width)
+            input: numpy array with shape (batch, in_channel, in_height, in_width)
+            weights: numpy array with shape (out_channel, in_channel, kernel_h, kernel_w)
+
+        # Returns
+            in_grad: gradient to the forward input of conv layer, with same shape as input
+            w_grad: gradient to weights, with same shape as weights
+        """
+        import torch
+
+        dtype = get_float_dtype(input, weights, out_grad)
+        stride = self.conv_params['stride']
+        padding = self.conv_params['pad'] // 2
+        x = torch.from_numpy(np.ascontiguousarray(input, dtype=dtype))
+        w = torch.from_numpy(np.ascontiguousarray(weights, dtype=dtype))
+        g = torch.from_numpy(np.ascontiguousarray(out_grad, dtype=dtype))
+        in_grad = torch.nn.grad.conv2d_input(x.shape, w, g, stride=stride, padding=padding)
+        w_grad = torch.nn.grad.conv2d_weight(x, w.shape, g, stride=stride, padding=padding)
+        return in_grad.numpy(), w_grad.numpy()
+
+
     def forward(self, input, weights, bias):
         """
         # Arguments
@@ -270,21 +462,40 @@ class conv(operator):
         batch, in_channel, in_height, in_width = input.shape
         #####################################################################################
         # code here
-        # Add zero padding to height and width dimensions of input
-        p = int(pad / 2) # pad is guaranteed to be even
-        X_pad = np.pad(input, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant', constant_values=0)
-
-        # Reshape input feature maps and filters    
-        X_hat, out_height, out_width = self.img2col(X_pad, batch, in_channel, in_height, in_width, kernel_h, kernel_w, pad, stride)
+        self._cache = None
+        algorithm = self.conv_params.get('algorithm', 'im2col')
+        if algorithm == 'torch' and has_torch:
+            return self.torch_forward(input, weights, bias)
+        if algorithm == 'winograd' and has_numba and kernel_h == 3 and kernel_w == 3 and stride == 1:
+            return self.winograd(input, weights, bias)
+        if algorithm == 'direct' and has_numba:
+            out_height = get_output_size(in_height, kernel_h, pad, stride)
+            out_width = get_output_size(in_width, kernel_w, pad, stride)
+            dtype = get_float_dtype(input, weights, bias)
+            output = np.empty((batch, out_channel, out_height, out_width), dtype=dtype)
+            if pad > 0:
+                # Reused across calls, only the interior is ever written so the border stays zero
+                X_pad = self.get_buffer('X_pad', (batch, in_channel, in_height + pad, in_width + pad), dtype)
+                X_pad[:, :, pad // 2:pad // 2 + in_height, pad // 2:pad // 2 + in_width] = input
+            else:
+                X_pad = input
+            conv2d_direct(X_pad, weights, bias, stride, output)
+            return output
+
+        # Reshape input feature maps and filters, zero padding is handled inside img2col
+        X_hat, out_height, out_width = self.img2col(input, batch, in_channel, in_height, in_width, kernel_h, kernel_w, pad, stride,
+                                                    dtype=get_float_dtype(input, weights))
+        if not np.may_share_memory(X_hat, input):
+            # X_hat lives in a buffer that only img2col writes, so it is still valid in backward for the same input
+            self._cache = (input.copy(), X_hat)
         W = weights.reshape((out_channel, in_channel * kernel_h * kernel_w))
-        b = np.repeat(bias, batch * out_height * out_width).reshape(out_channel, -1)
 
-        # Compute output
-        Y = W.dot(X_hat) + b
+        # Compute output, W is broadcast over the batch dimension of X_hat. The bias is added in place, without a temporary
+        Y = np.matmul(W, X_hat)
+        Y += bias[:, None]
 
         # Reshape output to correct shape
-        output = Y.reshape(out_channel, out_height, out_width, batch)
-        output = output.transpose(3, 0, 1, 2)
+        output = Y.reshape(batch, out_channel, out_height, out_width)
         #####################################################################################
         return output
 
@@ -292,7 +503,7 @@ class conv(operator):
     def col2img(self, dX_hat, N, c_i, n_h, n_w, k_h, k_w, p, s):
         """
         # Arguments
-            dX_hat: img2col representation of gradient to the forward input of conv layer
+            dX_hat: img2col representation of gradient to the forward input of conv layer, with shape (N, c_i * k_h * k_w, o_h * o_w)
             N: batch size (number of instances)
             c_i: number of input channels
             n_h: input height
@@ -308,23 +519,37 @@ class conv(operator):
         o_h = get_output_size(n_h, k_h, p, s)
         o_w = get_output_size(n_w, k_w, p, s)
 
-        # Empty array to fill with gradient values
-        dX_pad = np.zeros((N, c_i, n_h + p, n_w + p))
-        
-        channel_idxs, height_idxs, width_ixds = self.get_im2col_data_indexes(N, c_i, n_h, n_w, k_h, k_w, p, s, o_h, o_w)
-
-        # Get img2col for each batch instance
-        dX_hat_batch = dX_hat.reshape(c_i * k_h * k_w, -1, N)
-        dX_hat_batch = dX_hat_batch.transpose(2, 0, 1)
+        if k_h == 1 and k_w == 1 and p == 0:
+            # Pointwise convolution, every input pixel is read at most once
+            if s == 1:
+                return dX_hat.reshape(N, c_i, n_h, n_w)
+            dX = np.zeros((N, c_i, n_h, n_w), dtype=dX_hat.dtype)
+            dX[:, :, ::s, ::s] = dX_hat.reshape(N, c_i, o_h, o_w)
+            return dX
 
         # Fill in output with values from img2col batches
-        np.add.at(dX_pad, (slice(None), channel_idxs, height_idxs, width_ixds), dX_hat_batch)
-
-        # Remove padding rows and columns
-        if p != 0:
-            dX = dX_pad[:, :, p:-p, p:-p]
+        if has_numba:
+            dX_pad = np.zeros((N, c_i, n_h + p, n_w + p), dtype=dX_hat.dtype)
+            col2im_accumulate(dX_hat.reshape(N, c_i, k_h, k_w, o_h, o_w), s, dX_pad)
         else:
-            dX = dX_pad
+            # Every element is written by bincount below
+            dX_pad = np.empty((N, c_i, n_h + p, n_w + p), dtype=dX_hat.dtype)
+            key = ('flat', c_i, n_h, n_w, k_h, k_w, p, s)
+            if key not in self._idx_cache:
+                channel_idxs, height_idxs, width_ixds = self.get_im2col_data_indexes(N, c_i, n_h, n_w, k_h, k_w, p, s, o_h, o_w)
+                # Flat index of every element of one instance's columns into its padded input
+                self._idx_cache[key] = ((channel_idxs * (n_h + p) + height_idxs) * (n_w + p) + width_ixds).ravel()
+            flat_idxs = self._idx_cache[key]
+            dX_pad_flat = dX_pad.reshape(N, -1)
+            dX_hat_flat = dX_hat.reshape(N, -1)
+            size = dX_pad_flat.shape[1]
+            for n in range(N):
+                # bincount sums the weights of repeated indices in one C loop, faster than np.add.at.
+                # One instance at a time keeps the index array small, a single call over the whole batch is slower
+                dX_pad_flat[n] = np.bincount(flat_idxs, weights=dX_hat_flat[n], minlength=size)
+
+        # Remove padding rows and columns, half of the total padding is on each side
+        dX = dX_pad[:, :, p // 2:p // 2 + n_h, p // 2:p // 2 + n_w]
         
         return dX
 
@@ -354,20 +579,38 @@ class conv(operator):
         batch, in_channel, in_height, in_width = input.shape
         #################################################################################
         # code here
-        # Reshape input, weights, and gradient to col
-        p = int(pad / 2) # pad is guaranteed to be even
-        X_pad = np.pad(input, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant', constant_values=0)
-        X_hat, out_height, out_width = self.img2col(X_pad, batch, in_channel, in_height, in_width, kernel_h, kernel_w, pad, stride)
+        if self.conv_params.get('algorithm', 'im2col') == 'torch' and has_torch:
+            in_grad, w_grad = self.torch_backward(out_grad, input, weights)
+            b_grad = np.sum(out_grad, axis=(0, 2, 3))
+            return in_grad, w_grad, b_grad
+
+        # Reshape input, weights, and gradient to col, the columns of the forward pass are reused when the input is unchanged
+        dtype = get_float_dtype(input, weights)
+        if self._cache is not None and self._cache[1].dtype == dtype and np.array_equal(self._cache[0], input):
+            X_hat = self._cache[1]
+            out_height = get_output_size(in_height, kernel_h, pad, stride)
+            out_width = get_output_size(in_width, kernel_w, pad, stride)
+        else:
+            # img2col overwrites the cached columns
+            self._cache = None
+            X_hat, out_height, out_width = self.img2col(input, batch, in_channel, in_height, in_width, kernel_h, kernel_w, pad, stride,
+                                                        dtype=dtype)
 
         W = weights.reshape((out_channel, in_channel * kernel_h * kernel_w))
         
-        out_grad_col = out_grad.transpose(1, 2, 3, 0).reshape((out_channel, batch * out_height * out_width))
+        out_grad_col = out_grad.reshape((batch, out_channel, out_height * out_width))
 
-        # Compute gradients
-        dX_hat = W.transpose().dot(out_grad_col)
+        # Compute gradients, the column gradient is transient unless it already is the input gradient (pointwise kernels)
+        if kernel_h == 1 and kernel_w == 1 and pad == 0 and stride == 1:
+            dX_hat = np.matmul(W.transpose(), out_grad_col)
+        else:
+            dX_hat = get_scratch('dX_hat', X_hat.shape, get_float_dtype(W, out_grad_col))
+            np.matmul(W.transpose(), out_grad_col, out=dX_hat)
         in_grad = self.col2img(dX_hat, batch, in_channel, in_height, in_width, kernel_h, kernel_w, pad, stride)
         
-        w_grad = out_grad_col.dot(X_hat.transpose())
+        # Batched GEMM then a sum over the batch. A single GEMM contracting (batch, L) at once (einsum/tensordot)
+        # first has to copy X_hat into (K, batch * L) order, which makes it slower, not faster
+        w_grad = np.matmul(out_grad_col, X_hat.transpose(0, 2, 1)).sum(axis=0)
         w_grad = w_grad.reshape((out_channel, in_channel, kernel_h, kernel_w))
 
         b_grad = np.sum(out_grad, axis=(0, 2, 3)) # sum up for all batches, heights and widths in a channel
@@ -388,6 +631,37 @@ class pool(operator):
         """
         super(pool, self).__init__()
         self.pool_params = pool_params
+        # (input, offset) of the last max pooling forward, reused by backward
+        self._cache = None
+
+    def get_max_offsets(self, X_pad, out_height, out_width):
+        """
+        # Arguments
+            X_pad: padded input array with shape (batch, in_channel, height, width)
+            out_height: height of output
+            out_width: width of output
+
+        # Returns
+            best: maximum of every window, with shape (batch, in_channel, out_height, out_width)
+            offset: position of the (first) maximum of every window relative to its corner, as a flat index into X_pad's planes
+        """
+        pool_height = self.pool_params['pool_height']
+        pool_width = self.pool_params['pool_width']
+        stride = self.pool_params['stride']
+
+        # Running max over the kernel offsets on strided slices, only arrays of the output size are allocated
+        h_end, w_end = stride * (out_height - 1) + 1, stride * (out_width - 1) + 1
+        best = X_pad[:, :, :h_end:stride, :w_end:stride].astype(get_float_dtype(X_pad))
+        offset = np.zeros(best.shape, dtype=np.intp)
+        for i in range(pool_height):
+            for j in range(pool_width):
+                if i == 0 and j == 0:
+                    continue
+                fields = X_pad[:, :, i:i + h_end:stride, j:j + w_end:stride]
+                greater = fields > best
+                np.maximum(best, fields, out=best)
+                np.putmask(offset, greater, i * X_pad.shape[3] + j)
+        return best, offset
 
     def forward(self, input):
         """
@@ -410,25 +684,31 @@ class pool(operator):
         out_width = get_output_size(in_width, pool_width, pad, stride)
 
         p = int(pad / 2) # pad is guaranteed to be even
-        X_pad = np.pad(input, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant', constant_values=0)
-
-        output = np.zeros((out_height, out_width, batch, in_channel))
-        for i in range(out_height):
-            for j in range(out_width):
-                height_offset = i * stride
-                width_offset = j * stride
-
-                # Pool for receptive fields over all channels for full batch. Result shape is (batch, in_channel)
-                receptive_fields = X_pad[:, :, height_offset:height_offset + pool_height, width_offset:width_offset + pool_width]
-                if pool_type == 'max':
-                    output[i,j] = np.amax(receptive_fields, axis=(2,3)) 
-                elif pool_type == 'avg':
-                    output[i,j] = np.mean(receptive_fields, axis=(2,3)) 
-                else:
-                    raise TypeError("Error: pool_type should be 'max' or 'avg'")
+        if p != 0:
+            # Only the interior is written, the zero border of the cached buffer is kept
+            X_pad = self.get_buffer('X_pad', (batch, in_channel, in_height + 2 * p, in_width + 2 * p), input.dtype)
+            X_pad[:, :, p:p + in_height, p:p + in_width] = input
+        else:
+            X_pad = input
 
-        # Change (out_height, out_width, batch, in_channel) to (batch, in_channel, out_height, out_width)
-        output = output.transpose(2,3,0,1)
+        self._cache = None
+        if pool_type == 'max':
+            output, offset = self.get_max_offsets(X_pad, out_height, out_width)
+            # The window maxima are reused by backward as long as the input is unchanged
+            self._cache = (input.copy(), offset)
+        elif pool_type == 'avg':
+            # Sum the strided slice of every kernel offset over all windows at once, like get_max_offsets,
+            # pool_height * pool_width whole-array adds instead of one small reduction per output pixel
+            h_end = (out_height - 1) * stride + 1
+            w_end = (out_width - 1) * stride + 1
+            output = X_pad[:, :, :h_end:stride, :w_end:stride].astype(get_float_dtype(input))
+            for i in range(pool_height):
+                for j in range(pool_width):
+                    if i or j:
+                        output += X_pad[:, :, i:i + h_end:stride, j:j + w_end:stride]
+            output /= pool_height * pool_width
+        else:
+            raise TypeError("Error: pool_type should be 'max' or 'avg'")
         #####################################################################################
         return output
 
@@ -452,39 +732,43 @@ class pool(operator):
         out_width = 1 + (in_width - pool_width + pad) // stride
 
         pad_scheme = (pad//2, pad - pad//2)
-        input_pad = np.pad(input, pad_width=((0,0), (0,0), pad_scheme, pad_scheme),
-                           mode='constant', constant_values=0)
-
-        recep_fields_h = [stride*i for i in range(out_height)]
-        recep_fields_w = [stride*i for i in range(out_width)]
-
-        input_pool = img2col(input_pad, recep_fields_h,
-                             recep_fields_w, pool_height, pool_width)
-        input_pool = input_pool.reshape(
-            batch, in_channel, -1, out_height, out_width)
+        pad_height, pad_width = in_height + pad, in_width + pad
 
+        input_pad_grad = np.zeros((batch, in_channel, pad_height, pad_width), dtype=get_float_dtype(out_grad))
         if pool_type == 'max':
-            input_pool_grad = (input_pool == np.max(input_pool, axis=2, keepdims=True)) * \
-                out_grad[:, :, np.newaxis, :, :]
+            if self._cache is not None and np.array_equal(self._cache[0], input):
+                offset = self._cache[1]
+            else:
+                if pad != 0:
+                    input_pad = self.get_buffer('X_pad', (batch, in_channel, pad_height, pad_width), input.dtype)
+                    input_pad[:, :, pad_scheme[0]:pad_scheme[0]+in_height, pad_scheme[0]:pad_scheme[0]+in_width] = input
+                else:
+                    input_pad = input
+                _, offset = self.get_max_offsets(input_pad, out_height, out_width)
+
+            # Flat index of every maximum into input_pad_grad
+            planes = np.arange(batch * in_channel).reshape(batch, in_channel, 1, 1) * (pad_height * pad_width)
+            corners = (np.arange(out_height) * (stride * pad_width)).reshape(-1, 1) + np.arange(out_width) * stride
+            idx = offset + planes + corners
+            # Overlapping windows can share a maximum, np.add.at accumulates repeated indices
+            np.add.at(input_pad_grad.reshape(-1), idx.ravel(), out_grad.ravel())
 
         elif pool_type == 'avg':
             scale = 1 / (pool_height*pool_width)
-            input_pool_grad = scale * \
-                np.repeat(out_grad[:, :, np.newaxis, :, :],
-                          pool_height*pool_width, axis=2)
-
-        input_pool_grad = input_pool_grad.reshape(
-            batch, in_channel, -1, out_height*out_width)
-
-        input_pad_grad = np.zeros(input_pad.shape)
-        idx = 0
-        for i in recep_fields_h:
-            for j in recep_fields_w:
-                input_pad_grad[:, :, i:i+pool_height, j:j+pool_width] += \
-                    input_pool_grad[:, :, :, idx].reshape(
-                        batch, in_channel, pool_height, pool_width)
-                idx += 1
-        in_grad = input_pad_grad[:, :, pad:pad+in_height, pad:pad+in_width]
+            # Zero-copy broadcast of the scaled gradient over the window axes
+            input_pool_grad = np.broadcast_to((scale * out_grad)[:, :, np.newaxis, np.newaxis, :, :],
+                                              (batch, in_channel, pool_height, pool_width, out_height, out_width))
+            if has_numba:
+                col2im_accumulate(input_pool_grad, stride, input_pad_grad)
+            else:
+                for i in range(pool_height):
+                    for j in range(pool_width):
+                        input_pad_grad[:, :, i:i + stride * out_height:stride, j:j + stride * out_width:stride] += \
+                            input_pool_grad[:, :, i, j]
+
+        else:
+            raise TypeError("Error: pool_type should be 'max' or 'avg'")
+        in_grad = input_pad_grad[:, :, pad_scheme[0]:pad_scheme[0]+in_height, pad_scheme[0]:pad_scheme[0]+in_width]
         return in_grad
 
 
@@ -495,12 +779,14 @@ class dropout(operator):
             rate: float[0, 1], the probability of setting a neuron to zero
             training: boolean, apply this layer for training or not. If for training, randomly drop neurons, else DO NOT drop any neurons
             seed: int, random seed to sample from input, so as to get mask, which is convenient to check gradients. But for real training, it should be None to make sure to randomly drop neurons
-            mask: the mask with value 0 or 1, corresponding to drop neurons (0) or not (1). same shape as input
+            mask: boolean mask, corresponding to drop neurons (False) or not (True). same shape as input
         """
         self.rate = rate
         self.seed = seed
         self.training = training
         self.mask = None
+        # Own generator instead of the global legacy one, used when seed is None
+        self.rng = np.random.default_rng()
 
     def forward(self, input):
         """
@@ -512,14 +798,16 @@ class dropout(operator):
         """
         if self.training:
             scale = 1/(1-self.rate)
-            np.random.seed(self.seed)
-            p = np.random.random_sample(input.shape)
+            # A fixed seed restarts the stream, so that every forward draws the same mask
+            rng = self.rng if self.seed is None else np.random.default_rng(self.seed)
+            # 16-bit samples take a quarter of the memory of float64 ones, and still resolve rate to 1/65536
+            p = rng.integers(0, 1 << 16, size=input.shape, dtype=np.uint16)
             # Please use p as the probability to decide whether drop or not
-            self.mask = (p >= self.rate).astype('int')
+            self.mask = p >= int(round(self.rate * (1 << 16)))
             #####################################################################################
             # code here
-            self.mask = self.mask * scale
             output = input * self.mask
+            output *= scale
             #####################################################################################
         else:
             output = input
@@ -530,7 +818,7 @@ class dropout(operator):
         # Arguments
             out_grad: gradient to forward output of dropout, same shape as input
             input: numpy array with any shape
-            mask: the mask with value 0 or 1, corresponding to drop neurons (0) or not (1). same shape as input
+            mask: boolean mask, corresponding to drop neurons (False) or not (True). same shape as input
 
         # Returns
             in_grad: gradient to forward input of dropout, same shape as input
@@ -539,6 +827,7 @@ class dropout(operator):
             #####################################################################################
             # code here
             in_grad = out_grad * self.mask
+            in_grad *= 1/(1-self.rate)
             #####################################################################################
         else:
             in_grad = out_grad
@@ -568,20 +857,23 @@ class vanilla_rnn(operator):
         output = np.tanh(x.dot(kernel) + prev_h.dot(recurrent_kernel) + bias)
         return output
 
-    def backward(self, out_grad, input, kernel, recurrent_kernel, bias):
+    def backward(self, out_grad, input, kernel, recurrent_kernel, bias, output=None):
         """
         # Arguments
             in_grads: numpy array with shape (batch, units), gradients to outputs
             inputs: [input numpy array with shape (batch, in_features), 
                     state numpy array with shape (batch, units)], same with forward inputs
+            output: optional, the forward output for the same inputs and weights, recomputed when not given
 
         # Returns
             out_grads: [gradients to input numpy array with shape (batch, in_features), 
                         gradients to state numpy array with shape (batch, units)]
         """
         x, prev_h = input
+        if output is None:
+            output = self.forward(input, kernel, recurrent_kernel, bias)
         tanh_grad = np.nan_to_num(
-            out_grad*(1-np.square(self.forward(input, kernel, recurrent_kernel, bias))))
+            out_grad*(1-np.square(output)))
 
         in_grad = [np.matmul(tanh_grad, kernel.T), np.matmul(
             tanh_grad, recurrent_kernel.T)]
@@ -602,7 +894,30 @@ class gru(operator):
         """
         super(gru, self).__init__()
 
-    def forward(self, input, kernel, recurrent_kernel):
+    def gates(self, x, prev_h, kernel, recurrent_kernel, units):
+        """
+        # Arguments
+            x: input numpy array with shape (batch, in_features)
+            prev_h: state numpy array with shape (batch, units)
+            kernel: input weights with shape (in_features, 3 * units)
+            recurrent_kernel: gate and cell state weights with shape (units, 3 * units)
+            units: int, the number of hidden units
+
+        # Returns
+            x_z, x_r, x_h: update, reset and new gates, each with shape (batch, units)
+        """
+        # One wide GEMM for the input part of all three gates and one for the recurrent part of z and r,
+        # instead of a narrow GEMM per gate on non-contiguous column slices of the kernels
+        x_all = x.dot(kernel)
+        x_zr = x_all[:, :2*units] + prev_h.dot(recurrent_kernel[:, :2*units])
+        # update and reset gates
+        x_zr = sigmoid(x_zr)
+        x_z, x_r = x_zr[:, :units], x_zr[:, units:]
+        # new gate
+        x_h = np.tanh(x_all[:, 2*units:] + (x_r * prev_h).dot(recurrent_kernel[:, 2*units:]))
+        return x_z, x_r, x_h
+
+    def forward(self, input, kernel, recurrent_kernel, return_gates=False):
         """
         # Arguments
             inputs: [input numpy array with shape (batch, in_features), 
@@ -612,39 +927,34 @@ class gru(operator):
                     each has shape (in_features, units)
             recurrent_kernel: gate and cell state weights with shape (units, 3 * units)
                               each has shape (units, units)
+            return_gates: bool, whether to also return the gates, which backward can reuse
 
         # Returns
             outputs: numpy array with shape (batch, units)
+            gates: (x_z, x_r, x_h), only if return_gates
         """
         x, prev_h = input
         _, all_units = kernel.shape
         units = all_units // 3
-        kernel_z, kernel_r, kernel_h = kernel[:, :units], kernel[:, units:2*units],  kernel[:, 2*units:all_units]
-        recurrent_kernel_z = recurrent_kernel[:, :units]
-        recurrent_kernel_r = recurrent_kernel[:, units:2*units]
-        recurrent_kernel_h = recurrent_kernel[:, 2*units:all_units]
 
         #####################################################################################
         # code here
-        # Each of these gates are of shape (batch, units)
-        # update gate
-        x_z = sigmoid(x.dot(kernel_z) + prev_h.dot(recurrent_kernel_z))
-        # reset gate
-        x_r = sigmoid(x.dot(kernel_r) + prev_h.dot(recurrent_kernel_r))
-        # new gate
-        x_h = np.tanh(x.dot(kernel_h) + (x_r * prev_h).dot(recurrent_kernel_h))
+        x_z, x_r, x_h = self.gates(x, prev_h, kernel, recurrent_kernel, units)
         #####################################################################################
 
         output = (1 - x_z) * x_h + x_z * prev_h
         
+        if return_gates:
+            return output, (x_z, x_r, x_h)
         return output
 
-    def backward(self, out_grad, input, kernel, recurrent_kernel):
+    def backward(self, out_grad, input, kernel, recurrent_kernel, gates=None):
         """
         # Arguments
             out_grad: numpy array with shape (batch, units), gradients to outputs
             inputs: [input numpy array with shape (batch, in_features), 
                     state numpy array with shape (batch, units)], same with forward inputs
+            gates: optional, the gates returned by forward for the same inputs and weights, recomputed when not given
 
         # Returns
             in_grad: [gradients to input numpy array with shape (batch, in_features), 
@@ -653,17 +963,14 @@ class gru(operator):
         x, prev_h = input
         _, all_units = kernel.shape
         units = all_units // 3
-        kernel_z, kernel_r, kernel_h = kernel[:, :units], kernel[:, units:2*units],  kernel[:, 2*units:all_units]
-        recurrent_kernel_z = recurrent_kernel[:, :units]
-        recurrent_kernel_r = recurrent_kernel[:, units:2*units]
         recurrent_kernel_h = recurrent_kernel[:, 2*units:all_units]
 
         #####################################################################################
         # code here
         # gates
-        x_z = sigmoid(x.dot(kernel_z) + prev_h.dot(recurrent_kernel_z))
-        x_r = sigmoid(x.dot(kernel_r) + prev_h.dot(recurrent_kernel_r))
-        x_h = np.tanh(x.dot(kernel_h) + (x_r * prev_h).dot(recurrent_kernel_h))
+        if gates is None:
+            gates = self.gates(x, prev_h, kernel, recurrent_kernel, units)
+        x_z, x_r, x_h = gates
 
         # Given:
         # output = (1 - x_z) * x_h + x_z * prev_h
@@ -673,43 +980,56 @@ class gru(operator):
         # x_r = sigmoid(x_r_raw)
         # x_r_raw = x . kernel_r  +  prev_h . recurrent_kernel_r
 
+        # The raw gate gradients are written side by side in z, r, h order, the column order of the kernels,
+        # so that each weight gradient and the input gradient take a single wide GEMM
+        raw_grad = np.empty((out_grad.shape[0], all_units), dtype=np.result_type(out_grad, x_z))
+        x_z_raw_grad = raw_grad[:, :units]
+        x_r_raw_grad = raw_grad[:, units:2*units]
+        x_h_raw_grad = raw_grad[:, 2*units:]
+
+        # The elementwise chains below are evaluated in place, in raw_grad or in one (batch, units) temporary,
+        # in the same order as the formulas so that the results do not change. The gates are not modified,
+        # they can be the cached ones of forward
+        tmp = np.empty_like(x_z_raw_grad)
+        one_minus_z = 1 - x_z
+
         # ∂L/∂z = ∂L/∂output * ∂output/∂z = out_grad * (-x_h + prev_h)  
-        x_z_grad = out_grad * (prev_h - x_h)
+        np.subtract(prev_h, x_h, out=x_z_raw_grad)
+        np.multiply(out_grad, x_z_raw_grad, out=x_z_raw_grad)
         # ∂L/∂z_raw = ∂L/∂z * ∂z/∂z_raw = x_z_grad * x_z * (1 - x_z)
-        x_z_raw_grad = x_z_grad * x_z * (1 - x_z)
+        x_z_raw_grad *= x_z
+        x_z_raw_grad *= one_minus_z
         
         # ∂L/∂h = ∂L/∂output * ∂output/∂h = out_grad * (1 - x_z)
-        x_h_grad = out_grad * (1 - x_z)
+        np.multiply(out_grad, one_minus_z, out=x_h_raw_grad)
         # ∂L/∂h_raw = ∂L/∂h * ∂h/∂h_raw = x_h_grad * (1 - x_h^2)
-        x_h_raw_grad = x_h_grad * (1 - x_h ** 2)
+        np.square(x_h, out=tmp)
+        np.subtract(1, tmp, out=tmp)
+        x_h_raw_grad *= tmp
         
+        # ∂L/∂(x_r * prev_h) = x_h_raw_grad * transpose(recurrent_kernel_h), shared by the r and prev_h gradients
+        x_rh_grad = x_h_raw_grad.dot(recurrent_kernel_h.transpose())
         # ∂L/∂r = ∂L/∂h_raw * ∂h_raw/∂r = x_h_raw_grad * transpose(recurrent_kernel_h) * prev_h
-        x_r_grad = x_h_raw_grad.dot(recurrent_kernel_h.transpose()) * prev_h
+        np.multiply(x_rh_grad, prev_h, out=x_r_raw_grad)
         # ∂L/∂r_raw = ∂L/∂r * ∂r/∂r_raw = x_r_grad * x_r * (1 - x_r)
-        x_r_raw_grad = x_r_grad * x_r * (1 - x_r)
-
+        x_r_raw_grad *= x_r
+        np.subtract(1, x_r, out=tmp)
+        x_r_raw_grad *= tmp
 
-        x_grad = x_z_raw_grad.dot(kernel_z.transpose()) \
-                    + x_r_raw_grad.dot(kernel_r.transpose()) \
-                    + x_h_raw_grad.dot(kernel_h.transpose())
+        x_grad = raw_grad.dot(kernel.transpose())
 
-        prev_h_grad = x_z_raw_grad.dot(recurrent_kernel_z.transpose()) \
-                        + x_r_raw_grad.dot(recurrent_kernel_r.transpose()) \
-                        + x_h_raw_grad.dot(recurrent_kernel_h.transpose()) * x_r \
-                        + out_grad * x_z
+        prev_h_grad = raw_grad[:, :2*units].dot(recurrent_kernel[:, :2*units].transpose())
+        prev_h_grad += np.multiply(x_rh_grad, x_r, out=tmp)
+        prev_h_grad += np.multiply(out_grad, x_z, out=tmp)
 
-        kernel_r_grad = x.transpose().dot(x_r_raw_grad)
-        kernel_z_grad = x.transpose().dot(x_z_raw_grad)
-        kernel_h_grad = x.transpose().dot(x_h_raw_grad)
+        kernel_grad = x.transpose().dot(raw_grad)
 
-        recurrent_kernel_r_grad = prev_h.transpose().dot(x_r_raw_grad)
-        recurrent_kernel_z_grad = prev_h.transpose().dot(x_z_raw_grad)
-        recurrent_kernel_h_grad = (prev_h * x_r).transpose().dot(x_h_raw_grad)
+        r_kernel_grad = np.empty_like(recurrent_kernel, dtype=np.result_type(prev_h, raw_grad))
+        r_kernel_grad[:, :2*units] = prev_h.transpose().dot(raw_grad[:, :2*units])
+        r_kernel_grad[:, 2*units:] = (prev_h * x_r).transpose().dot(x_h_raw_grad)
         #####################################################################################
 
         in_grad = [x_grad, prev_h_grad]
-        kernel_grad = np.concatenate([kernel_z_grad, kernel_r_grad, kernel_h_grad], axis=-1)
-        r_kernel_grad = np.concatenate([recurrent_kernel_z_grad, recurrent_kernel_r_grad, recurrent_kernel_h_grad], axis=-1)
 
         return in_grad, kernel_grad, r_kernel_grad
 
@@ -717,6 +1037,8 @@ class gru(operator):
 class softmax_cross_entropy(operator):
     def __init__(self):
         super(softmax_cross_entropy, self).__init__()
+        # (input, labels, probs) of the last forward, reused by backward
+        self._cache = None
 
     def forward(self, input, labels):
         """
@@ -733,12 +1055,23 @@ class softmax_cross_entropy(operator):
         eps = 1e-12
 
         batch = len(labels)
-        input_shift = input - np.max(input, axis=1, keepdims=True)
-        Z = np.sum(np.exp(input_shift), axis=1, keepdims=True)
-
-        log_probs = input_shift - np.log(Z+eps)
-        probs = np.exp(log_probs)
-        output = -1 * np.sum(log_probs[np.arange(batch), labels]) / batch
+        # exp and log always run in double precision, the (batch, num_class) logits are cheap to upcast
+        # and a float32 model then still gets an accurate loss. probs is returned in the dtype of input
+        # Shift, exp and normalize all run in place on the one (batch, num_class) copy
+        probs = input.astype(np.float64)
+        probs -= np.max(probs, axis=1, keepdims=True)
+        # Only the log probabilities of the labels are needed for the loss, keep their shifted logits before exp
+        label_shift = probs[np.arange(batch), labels]
+        np.exp(probs, out=probs)
+        Z = np.sum(probs, axis=1, keepdims=True) + eps
+        probs /= Z
+
+        log_probs = label_shift - np.log(Z[:, 0])
+        output = -1 * np.sum(log_probs) / batch
+        probs = probs.astype(get_float_dtype(input), copy=False)
+
+        # The inputs are copied so that backward can tell whether they changed since
+        self._cache = (input.copy(), np.array(labels), probs)
         return output, probs
 
     def backward(self, input, labels):
@@ -751,14 +1084,12 @@ class softmax_cross_entropy(operator):
         # Returns
             in_grad: gradient to forward input of softmax cross entropy, with shape (batch, num_class)
         """
-        # precision to avoid overflow
-        eps = 1e-12
-
         batch = len(labels)
-        input_shift = input - np.max(input, axis=1, keepdims=True)
-        Z = np.sum(np.exp(input_shift), axis=1, keepdims=True)
-        log_probs = input_shift - np.log(Z+eps)
-        probs = np.exp(log_probs)
+        if self._cache is not None and np.array_equal(self._cache[0], input) \
+                and np.array_equal(self._cache[1], labels):
+            probs = self._cache[2]
+        else:
+            _, probs = self.forward(input, labels)
 
         in_grad = probs.copy()
         in_grad[np.arange(batch), labels] -= 1
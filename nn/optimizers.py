@@ -65,7 +65,7 @@ class SGD(Optimizer):
         if not self.momentum:
             self.momentum = {}
             for k, v in w_grads.items():
-                self.momentum[k] = np.zeros(v.shape)
+                self.momentum[k] = np.zeros_like(v)
         for k in list(w.keys()):
             self.momentum[k] = self.beta * self.momentum[k] + w_grads[k]
             new_w[k] = w[k] - self.lr * self.momentum[k]
@@ -108,7 +108,7 @@ class Adagrad(Optimizer):
         if not self.accumulators:
             self.accumulators = {}
             for k, v in w.items():
-                self.accumulators[k] = np.zeros(v.shape)
+                self.accumulators[k] = np.zeros_like(v)
         for k in list(w.keys()):
             self.accumulators[k] += w_grads[k]**2
             new_w[k] = w[k] - self.lr * w_grads[k] / (np.sqrt(self.accumulators[k] + self.epsilon))
@@ -153,7 +153,7 @@ class RMSprop(Optimizer):
         if not self.accumulators:
             self.accumulators = {}
             for k, v in w.items():
-                self.accumulators[k] = np.zeros(v.shape)
+                self.accumulators[k] = np.zeros_like(v)
         for k in list(w.keys()):
             #####################################################################################
             # code here
@@ -209,8 +209,8 @@ class Adam(Optimizer):
             self.momentum = {}
             self.accumulators = {}
             for k, v in w.items():
-                self.momentum[k] = np.zeros(v.shape)
-                self.accumulators[k] = np.zeros(v.shape)
+                self.momentum[k] = np.zeros_like(v)
+                self.accumulators[k] = np.zeros_like(v)
         for k in list(w.keys()):
             self.momentum[k] = self.beta_1 * self.momentum[k] + (1-self.beta_1) * w_grads[k]
             self.accumulators[k] = self.beta_2 * self.accumulators[k] + (1 - self.beta_2) * w_grads[k]**2